@@ -5,8 +5,9 @@ from dotenv import load_dotenv
 load_dotenv(dotenv_path=Path(__file__).resolve().parents[1] / ".env")
 
 from fastapi import Request, Response
-import os, hmac, hashlib, re
+import os, hmac, hashlib
 from typing import Tuple, Optional
+from app.database import NormalizedEmail
 
 # Админы
 _env_admins = [e.strip().lower() for e in os.getenv("ADMIN_EMAILS", "").split(",") if e.strip()]
@@ -15,24 +16,53 @@ ADMIN_EMAILS = set(_env_admins) | DEFAULT_ADMINS
 
 # Перец для паролей (не менять после запуска прод!)
 AUTH_PEPPER = os.getenv("AUTH_PEPPER", "dev_pepper_change_me")
+_PEPPER_BYTES = AUTH_PEPPER.encode("utf-8")
 
-EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+def _email_ok(e: str) -> bool:
+    r"""Same rule as ^[^@\s]+@[^@\s]+\.[^@\s]+$, via str ops instead of regex."""
+    local, at, domain = e.partition("@")
+    return bool(local and at and "@" not in domain and "." in domain[1:-1]
+                and not any(c.isspace() for c in e))
 
-def _norm_email(e: Optional[str]) -> Optional[str]:
-    return e.strip().lower() if e else None
+def _norm_email(e: Optional[str]) -> Optional[NormalizedEmail]:
+    return NormalizedEmail(e.strip().lower()) if e else None
 
-def hash_pw(pw: str) -> str:
+# PBKDF2 (OpenSSL). Формат: pbkdf2$sha256$<iterations>$<salt hex>$<dk hex>
+PBKDF2_ITERATIONS = 200_000
+PBKDF2_PREFIX = "pbkdf2$sha256$"
+
+def _legacy_hash_pw(pw: str) -> str:
+    pwd = (pw or "").strip().encode("utf-8")
+    return hmac.new(_PEPPER_BYTES, pwd, hashlib.sha256).hexdigest()
+
+def _pbkdf2(pw: str, salt: bytes, iterations: int) -> bytes:
     pwd = (pw or "").strip().encode("utf-8")
-    pepper = AUTH_PEPPER.encode("utf-8")
-    return hmac.new(pepper, pwd, hashlib.sha256).hexdigest()
+    return hashlib.pbkdf2_hmac("sha256", pwd, salt + _PEPPER_BYTES, iterations, dklen=32)
+
+def hash_pw(pw: str) -> str:
+    salt = os.urandom(16)
+    dk = _pbkdf2(pw, salt, PBKDF2_ITERATIONS)
+    return f"{PBKDF2_PREFIX}{PBKDF2_ITERATIONS}${salt.hex()}${dk.hex()}"
+
+def needs_rehash(pw_hash: str) -> bool:
+    return not (pw_hash or "").startswith(f"{PBKDF2_PREFIX}{PBKDF2_ITERATIONS}$")
 
 def verify_pw(pw_plain: str, pw_hash: str) -> bool:
-    return hash_pw(pw_plain) == (pw_hash or "")
+    pw_hash = pw_hash or ""
+    if pw_hash.startswith(PBKDF2_PREFIX):
+        try:
+            iters, salt_hex, dk_hex = pw_hash[len(PBKDF2_PREFIX):].split("$")
+            dk = _pbkdf2(pw_plain, bytes.fromhex(salt_hex), int(iters))
+            return hmac.compare_digest(dk, bytes.fromhex(dk_hex))
+        except ValueError:
+            return False
+    # старые аккаунты: один HMAC-SHA256, апгрейдятся при логине
+    return hmac.compare_digest(_legacy_hash_pw(pw_plain), pw_hash)
 
 def is_logged_in(request: Request) -> bool:
     return request.cookies.get("user") is not None
 
-def current_user(request: Request) -> Optional[str]:
+def current_user(request: Request) -> Optional[NormalizedEmail]:
     return _norm_email(request.cookies.get("user"))
 
 def is_admin(email: Optional[str]) -> bool:
@@ -58,11 +88,11 @@ def clear_login_cookie(resp: Response) -> None:
     resp.delete_cookie(COOKIE_NAME, path="/")
 
 # Работа с БД
-from app.database import get_user, create_user
+from app.database import get_user, create_user, set_password_hash
 
-def _validate(email: str, password: str) -> Tuple[Optional[str], Optional[str]]:
+def _validate(email: str, password: str) -> Tuple[Optional[NormalizedEmail], Optional[str]]:
     e = _norm_email(email)
-    if not e or not EMAIL_RE.match(e): return None, "Bad email"
+    if not e or not _email_ok(e): return None, "Bad email"
     if not password or len(password) < 6: return None, "Password >= 6 chars"
     return e, None
 
@@ -81,5 +111,8 @@ def authenticate_user(email: str, password: str) -> Tuple[bool, str]:
     if err: return False, err
     row = get_user(e)
     if not row: return False, "User not found"
-    if not verify_pw(password, str(row["password_hash"])): return False, "Invalid password"
+    pw_hash = str(row["password_hash"])
+    if not verify_pw(password, pw_hash): return False, "Invalid password"
+    if needs_rehash(pw_hash):
+        set_password_hash(e, hash_pw(password))
     return True, "OK"
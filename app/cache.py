@@ -0,0 +1,83 @@
+# app/cache.py
+import asyncio, threading, time
+from typing import Any, Callable, Hashable
+
+
+class TTLCache:
+    """Small thread-safe in-process cache: per-entry TTL, oldest entry evicted at maxsize."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: dict[Hashable, tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires, value = item
+            if expires <= time.monotonic():
+                del self._data[key]
+                return default
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        with self._lock:
+            if key not in self._data and len(self._data) >= self.maxsize:
+                self._data.pop(next(iter(self._data)))
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+# Кэш ответов внешних API (DexScreener, honeypot.is, explorers, t.me/Discord)
+_RESPONSES = TTLCache(maxsize=4096, ttl=3600)
+# Один запрос наружу на ключ: параллельные промахи ждут одну и ту же задачу
+_INFLIGHT: dict[Hashable, asyncio.Task] = {}
+
+
+async def _fill(key: Hashable, fn, args: tuple, kwargs: dict, ttl):
+    res = await fn(*args, **kwargs)
+    if isinstance(res, dict):
+        # "transient" is a cache-control hint for us only; it never reaches a response
+        transient = res.pop("transient", False)
+        if res.get("ok") and not res.get("error") and not transient:
+            _RESPONSES.set(key, res, ttl=ttl(res) if callable(ttl) else ttl)
+    return res
+
+
+def _done(key: Hashable, task: asyncio.Task) -> None:
+    if _INFLIGHT.get(key) is task:
+        del _INFLIGHT[key]
+    if not task.cancelled():
+        task.exception()  # retrieved even if every waiter went away
+
+
+async def cached(fn, *args, ttl: float | Callable[[dict], float] = 3600, **kwargs):
+    """
+    Awaits fn(*args, **kwargs) through an in-process TTL cache keyed by the call.
+    Only clean results (ok=True, no error, not transient) are stored, so failures
+    and degraded fallbacks are retried. ttl may be a callable picking it per result.
+    Concurrent misses on the same key share one upstream call and its result,
+    whether or not that result gets stored.
+    """
+    key = (fn.__module__, fn.__qualname__, args, tuple(sorted(kwargs.items())))
+    hit = _RESPONSES.get(key)
+    if hit is not None:
+        return hit
+    task = _INFLIGHT.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_fill(key, fn, args, kwargs, ttl))
+        _INFLIGHT[key] = task
+        task.add_done_callback(lambda t: _done(key, t))
+    # shield: a caller that disconnects must not cancel the call others are waiting on
+    return await asyncio.shield(task)
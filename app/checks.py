@@ -1,10 +1,11 @@
 
 import hashlib, re
 from dataclasses import dataclass
-from typing import Optional, Pattern, List, Dict, Any
+from functools import lru_cache
+from typing import Optional, Pattern, Dict, Any
 from app.sources import check_evm_wallet
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Net:
     name: str
     code: str
@@ -13,7 +14,7 @@ class Net:
 def _re(p: str) -> Pattern[str]:
     return re.compile(p)
 
-NETWORKS: List[Net] = [
+NETWORKS: tuple[Net, ...] = (
     # BTC family
     Net("Bitcoin", "BTC", _re(r'^(bc1[ac-hj-np-z02-9]{11,71}|[13][a-km-zA-HJ-NP-Z1-9]{25,34})$')),
     Net("Litecoin", "LTC", _re(r'^(ltc1[ac-hj-np-z02-9]{11,71}|[LM3][a-km-zA-HJ-NP-Z1-9]{26,33})$')),
@@ -41,20 +42,55 @@ NETWORKS: List[Net] = [
     Net("Near Protocol", "NEAR", _re(r'^[a-z0-9_\-\.]{2,64}\.near$')),
     Net("Tezos", "XTZ", _re(r'^(tz1|tz2|tz3|KT1)[1-9A-HJ-NP-Za-km-z]{33}$')),
     Net("TON", "TON", _re(r'^(EQ|UQ)[A-Za-z0-9\-_]{46,48}$')),
-]
+)
+
+# One alternation instead of a loop over NETWORKS. Identical patterns (all the
+# EVM chains) collapse to the first network that uses them, as the loop did.
+def _build_master() -> tuple[Pattern[str], Dict[str, Net]]:
+    by_group: Dict[str, Net] = {}
+    seen = set()
+    parts = []
+    for i, n in enumerate(NETWORKS):
+        if n.regex.pattern in seen:
+            continue
+        seen.add(n.regex.pattern)
+        name = f"n{i}"
+        by_group[name] = n
+        parts.append(f"(?P<{name}>{n.regex.pattern})")
+    return re.compile("|".join(parts)), by_group
+
+_MASTER_RE, _NET_BY_GROUP = _build_master()
+_master_match = _MASTER_RE.match
+
+EVM_CODES = frozenset({"ETH", "BSC", "POLYGON", "ARB", "OPT", "AVAX-C", "FTM", "CRO"})
+EVM_DEFAULT_NET = next(n for n in NETWORKS if n.code in EVM_CODES)
+_HEX_CHARS = frozenset("0123456789abcdefABCDEF")
 
 def detect_network(address: str) -> Optional[Net]:
     a = (address or "").strip()
-    for n in NETWORKS:
-        if n.regex.match(a):
-            return n
-    return None
+    # most inputs are 0x… EVM addresses: no regex needed
+    if len(a) == 42 and a[:2] == "0x" and _HEX_CHARS.issuperset(a[2:]):
+        return EVM_DEFAULT_NET
+    m = _master_match(a)
+    return _NET_BY_GROUP[m.lastgroup] if m else None
 
+@lru_cache(maxsize=8192)
 def _stable_score(addr: str) -> int:
-    h = hashlib.sha256(addr.encode()).hexdigest()
-    raw = int(h[:2], 16)
+    raw = hashlib.sha256(addr.encode()).digest()[0]
     return round(raw / 255 * 100)
 
+# label -> (color, summary) / tips; shared, never mutated
+_VERDICTS = {
+    "Safe": ("green", "High reputation. No obvious scam patterns detected."),
+    "Caution": ("yellow", "Some risk factors. Consider a small test transfer."),
+    "Risk": ("red", "High probability of scam. Avoid large transfers."),
+}
+_TIPS = {
+    "Safe": ("Double-check recipient", "Keep seed phrase offline"),
+    "Caution": ("Send a small test first", "Cross-check on other sources"),
+    "Risk": ("Do not send large amounts", "Ask for an alternative address"),
+}
+
 async def wallet_check(address: str) -> Dict[str, Any]:
     addr = (address or "").strip()
     net = detect_network(addr)
@@ -63,35 +99,30 @@ async def wallet_check(address: str) -> Dict[str, Any]:
 
     score = _stable_score(addr)
     signals = []
-    tips = []
+    transient = False  # explorer outage: show the result, but don't let cached() keep it
 
-    if net.code in {"ETH","BSC","POLYGON","ARB","OPT","AVAX-C","FTM","CRO"}:
-        evm = await check_evm_wallet(addr, net.code if net.code != "ETH" else "ETH")
+    if net.code in EVM_CODES:
+        evm = await check_evm_wallet(addr, net.code)
         if evm.get("ok"):
-            signals.append(f"Balance: {evm['balance_native']:.6f} native")
-            signals.append(f"Transactions: {evm['tx_count']}")
-            if evm['balance_native'] > 0 or evm['tx_count'] > 0:
+            bal, txs = evm["balance_native"], evm["tx_count"]
+            signals.append(f"Balance: {bal:.6f} native" if bal is not None else "Balance unavailable")
+            signals.append(f"Transactions: {txs}" if txs is not None else "Transactions unavailable")
+            # only fields the explorer actually returned count as activity
+            if (bal is not None and bal > 0) or (txs is not None and txs > 0):
                 score = max(score, 60)
+            if bal is None or txs is None:
+                transient = True
         else:
             signals.append("EVM explorer check failed")
+            transient = True
 
-    if score >= 80:
-        label, color = "Safe", "green"
-        summary = "High reputation. No obvious scam patterns detected."
-        signals.insert(0, f"Detected network: {net.name}")
-        tips = ["Double-check recipient", "Keep seed phrase offline"]
-    elif score >= 50:
-        label, color = "Caution", "yellow"
-        summary = "Some risk factors. Consider a small test transfer."
+    label = "Safe" if score >= 80 else ("Caution" if score >= 50 else "Risk")
+    color, summary = _VERDICTS[label]
+    if label != "Risk":
         signals.insert(0, f"Detected network: {net.name}")
-        tips = ["Send a small test first", "Cross-check on other sources"]
-    else:
-        label, color = "Risk", "red"
-        summary = "High probability of scam. Avoid large transfers."
-        if not signals:
-            signals = ["Suspicious heuristics"]
-        tips = ["Do not send large amounts", "Ask for an alternative address"]
+    elif not signals:
+        signals = ["Suspicious heuristics"]
 
     return {"ok": True, "address": addr, "network": net.name, "code": net.code,
             "score": score, "label": label, "color": color, "summary": summary,
-            "signals": signals, "tips": tips}
+            "signals": signals, "tips": _TIPS[label], "transient": transient}
@@ -0,0 +1,26 @@
+# app/config.py
+from pathlib import Path
+from dotenv import load_dotenv
+# .env лежит в корне проекта (на уровень выше папки app)
+load_dotenv(dotenv_path=Path(__file__).resolve().parents[1] / ".env")
+
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+
+
+@dataclass(frozen=True)
+class Settings:
+    nowpayments_ipn_secret: bytes
+    templates_auto_reload: bool
+    static_max_age: int
+
+
+@lru_cache
+def get_settings() -> Settings:
+    """Reads the environment once; every later call returns the same object."""
+    return Settings(
+        nowpayments_ipn_secret=os.getenv("NOWPAYMENTS_IPN_SECRET", "").encode(),
+        templates_auto_reload=os.getenv("TEMPLATES_AUTO_RELOAD", "0") == "1",
+        static_max_age=int(os.getenv("STATIC_MAX_AGE", "86400")),
+    )
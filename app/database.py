@@ -1,120 +1,173 @@
 # app/database.py
-import sqlite3, os, time
+import sqlite3, os, time, threading
+from contextlib import contextmanager
 from datetime import date
+from typing import NewType
+from app.cache import TTLCache
 
 DB_NAME = "users.db"
+
+# Email, уже приведённый к strip().lower() на границе (auth/main)
+NormalizedEmail = NewType("NormalizedEmail", str)
 DEFAULT_SUBSCRIPTION_DAYS = int(os.getenv("SUBSCRIPTION_DAYS", "30"))
 MAX_FREE_WALLET_CHECKS = int(os.getenv("MAX_FREE_WALLET_CHECKS", "3"))
+BADGE_CACHE_TTL = int(os.getenv("BADGE_CACHE_TTL", "5"))
+SUBSCRIPTION_CACHE_TTL = int(os.getenv("SUBSCRIPTION_CACHE_TTL", "120"))
 
-def _conn():
-    conn = sqlite3.connect(DB_NAME)
+# Бейдж лимитов рисуется на каждой странице; держим его несколько секунд.
+# У премиума счётчиков нет — его бейдж (и статус подписки) живёт дольше.
+# set_subscription сбрасывает запись.
+_BADGE_CACHE = TTLCache(maxsize=10_000, ttl=BADGE_CACHE_TTL)
+
+# Одно соединение на процесс (WAL), доступ сериализован локом
+_CONN: sqlite3.Connection | None = None
+_LOCK = threading.RLock()
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_NAME, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-64000")
     return conn
 
+@contextmanager
+def _conn():
+    """Yields the shared connection; commits on success, rolls back on error."""
+    global _CONN
+    with _LOCK:
+        if _CONN is None:
+            _CONN = _connect()
+        try:
+            yield _CONN
+            _CONN.commit()
+        except Exception:
+            _CONN.rollback()
+            raise
+
 def init_db():
-    conn = _conn(); cur = conn.cursor()
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS users(
-      id INTEGER PRIMARY KEY,
-      email TEXT UNIQUE,
-      password_hash TEXT,
-      subscription INTEGER DEFAULT 0,
-      subscription_until INTEGER,
-      wallet_checks_today INTEGER DEFAULT 0 NOT NULL,
-      last_wallet_check TEXT
-    )""")
-    conn.commit(); conn.close()
-
-def create_user(email: str, password_hash: str) -> None:
-    conn = _conn(); cur = conn.cursor()
-    try:
-        cur.execute(
+    with _conn() as conn:
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS users(
+          id INTEGER PRIMARY KEY,
+          email TEXT UNIQUE,
+          password_hash TEXT,
+          subscription INTEGER DEFAULT 0,
+          subscription_until INTEGER,
+          wallet_checks_today INTEGER DEFAULT 0 NOT NULL,
+          last_wallet_check TEXT
+        )""")
+
+def create_user(email: NormalizedEmail, password_hash: str) -> None:
+    with _conn() as conn:
+        conn.execute(
             "INSERT INTO users(email,password_hash) VALUES(?,?)",
-            (email.strip().lower(), password_hash)
+            (email, password_hash)
         )
-        conn.commit()
-    finally:
-        conn.close()
-
-def get_user(email: str):
-    conn = _conn(); cur = conn.cursor()
-    cur.execute(
-        "SELECT id,email,password_hash,subscription,subscription_until,wallet_checks_today,last_wallet_check "
-        "FROM users WHERE email=?", (email.strip().lower(),)
-    )
-    row = cur.fetchone(); conn.close()
-    return row
+
+def set_password_hash(email: NormalizedEmail, password_hash: str) -> None:
+    with _conn() as conn:
+        conn.execute("UPDATE users SET password_hash=? WHERE email=?",
+                     (password_hash, email))
+
+def get_user(email: NormalizedEmail):
+    with _conn() as conn:
+        return conn.execute(
+            "SELECT id,email,password_hash,subscription,subscription_until,wallet_checks_today,last_wallet_check "
+            "FROM users WHERE email=?", (email,)
+        ).fetchone()
 
 def _now_ts() -> int: return int(time.time())
 
-def has_active_subscription(email: str) -> bool:
-    row = get_user(email)
+# Функции ниже (кроме try_consume_wallet_check) принимают уже загруженную
+# строку (row), чтобы не делать повторный SELECT; без row читают сами.
+# try_consume_wallet_check строку не берёт: премиум отвечает кэш бейджа.
+def has_active_subscription(email: NormalizedEmail, row=None) -> bool:
+    if row is None:
+        badge = _BADGE_CACHE.get(email)
+        if badge is not None: return badge["is_premium"]
+        row = get_user(email)
     if not row: return False
     sub = int(row["subscription"] or 0)
     until = int(row["subscription_until"] or 0)
     return sub == 1 and until > _now_ts()
 
-def days_left(email: str) -> int:
-    row = get_user(email)
+def days_left(email: NormalizedEmail, row=None) -> int:
+    if row is None: row = get_user(email)
     if not row or not row["subscription_until"]: return 0
     delta = int(row["subscription_until"]) - _now_ts()
     return max(0, delta // (24*60*60))
 
-def set_subscription(email: str, sub: int, days: int | None = None):
+def set_subscription(email: NormalizedEmail, sub: int, days: int | None = None):
     if days is None: days = DEFAULT_SUBSCRIPTION_DAYS
-    conn = _conn(); cur = conn.cursor()
-    if sub:
-        cur.execute("SELECT subscription,subscription_until FROM users WHERE email=?", (email.strip().lower(),))
-        row = cur.fetchone(); now = _now_ts()
-        start_ts = int(row["subscription_until"]) if row and int(row["subscription"] or 0)==1 and int(row["subscription_until"] or 0) > now else now
-        until_ts = start_ts + days*24*60*60
-        cur.execute("UPDATE users SET subscription=?,subscription_until=? WHERE email=?",
-                    (1, until_ts, email.strip().lower()))
-        cur.execute("UPDATE users SET wallet_checks_today=?, last_wallet_check=? WHERE email=?",
-                    (0, date.today().isoformat(), email.strip().lower()))
-    else:
-        cur.execute("UPDATE users SET subscription=?,subscription_until=NULL WHERE email=?",
-                    (0, email.strip().lower()))
-    conn.commit(); conn.close()
-
-def _reset_daily_if_needed(cur, email: str):
-    today = date.today().isoformat()
-    cur.execute("SELECT wallet_checks_today,last_wallet_check FROM users WHERE email=?",
-                (email.strip().lower(),))
-    row = cur.fetchone()
-    if not row: return
-    if row["last_wallet_check"] != today:
-        cur.execute("UPDATE users SET wallet_checks_today=?, last_wallet_check=? WHERE email=?",
-                    (0, today, email.strip().lower()))
-
-def get_wallet_usage(email: str) -> tuple[int,int]:
-    conn = _conn(); cur = conn.cursor()
-    _reset_daily_if_needed(cur, email)
-    cur.execute("SELECT wallet_checks_today FROM users WHERE email=?", (email.strip().lower(),))
-    row = cur.fetchone(); conn.commit(); conn.close()
-    used = int(row["wallet_checks_today"] if row else 0)
+    with _conn() as conn:
+        if sub:
+            row = conn.execute("SELECT subscription,subscription_until FROM users WHERE email=?", (email,)).fetchone()
+            now = _now_ts()
+            start_ts = int(row["subscription_until"]) if row and int(row["subscription"] or 0)==1 and int(row["subscription_until"] or 0) > now else now
+            until_ts = start_ts + days*24*60*60
+            conn.execute("UPDATE users SET subscription=?,subscription_until=? WHERE email=?",
+                         (1, until_ts, email))
+            conn.execute("UPDATE users SET wallet_checks_today=?, last_wallet_check=? WHERE email=?",
+                         (0, date.today().isoformat(), email))
+        else:
+            conn.execute("UPDATE users SET subscription=?,subscription_until=NULL WHERE email=?",
+                         (0, email))
+    _BADGE_CACHE.pop(email)
+
+def get_wallet_usage(email: NormalizedEmail, row=None) -> tuple[int,int]:
+    if row is None: row = get_user(email)
+    # счётчик за прошлый день не считается (сбрасывается при следующем списании)
+    fresh = row and row["last_wallet_check"] == date.today().isoformat()
+    used = int(row["wallet_checks_today"] or 0) if fresh else 0
     left = max(0, MAX_FREE_WALLET_CHECKS - used)
     return used, left
 
-def try_consume_wallet_check(email: str) -> tuple[bool,int,str|None]:
+def try_consume_wallet_check(email: NormalizedEmail) -> tuple[bool,int,str|None]:
     if has_active_subscription(email): return True, -1, None
-    conn = _conn(); cur = conn.cursor()
-    _reset_daily_if_needed(cur, email)
-    cur.execute("SELECT wallet_checks_today FROM users WHERE email=?", (email.strip().lower(),))
-    row = cur.fetchone()
-    used = int(row["wallet_checks_today"] if row else 0)
-    if used >= MAX_FREE_WALLET_CHECKS:
-        conn.commit(); conn.close()
+    # Один атомарный UPDATE: сброс счётчика в новый день + проверка лимита
+    with _conn() as conn:
+        ret = conn.execute(
+            "UPDATE users SET "
+            "wallet_checks_today = CASE WHEN last_wallet_check IS ?1 THEN wallet_checks_today+1 ELSE 1 END, "
+            "last_wallet_check = ?1 "
+            "WHERE email=?2 AND (last_wallet_check IS NOT ?1 OR wallet_checks_today < ?3) "
+            "RETURNING wallet_checks_today",
+            (date.today().isoformat(), email, MAX_FREE_WALLET_CHECKS)
+        ).fetchone()
+    if not ret:
         return False, 0, "Free limit reached (5/day)."
-    used += 1
-    cur.execute("UPDATE users SET wallet_checks_today=? WHERE email=?", (used, email.strip().lower()))
-    conn.commit(); conn.close()
+    # бейдж собираем из RETURNING, без повторного SELECT
+    used = int(ret["wallet_checks_today"])
     left_after = max(0, MAX_FREE_WALLET_CHECKS - used)
+    _BADGE_CACHE.set(email, {"is_premium": False, "days_left": 0, "used_today": used,
+                             "left_today": left_after, "max_free": MAX_FREE_WALLET_CHECKS})
     return True, left_after, None
 
-def get_limits_badge(email: str) -> dict:
-    premium = has_active_subscription(email)
-    dleft = days_left(email) if premium else 0
-    used, left = get_wallet_usage(email) if not premium else (0, -1)
-    return {"is_premium": premium, "days_left": dleft, "used_today": used,
-            "left_today": left, "max_free": MAX_FREE_WALLET_CHECKS}
+def get_cached_badge(email: NormalizedEmail) -> dict | None:
+    return _BADGE_CACHE.get(email)
+
+def get_limits_badge(email: NormalizedEmail, row=None) -> dict:
+    badge = _BADGE_CACHE.get(email)
+    if badge is not None: return badge
+    if row is None: row = get_user(email)
+    premium = has_active_subscription(email, row)
+    dleft = days_left(email, row) if premium else 0
+    used, left = get_wallet_usage(email, row) if not premium else (0, -1)
+    badge = {"is_premium": premium, "days_left": dleft, "used_today": used,
+             "left_today": left, "max_free": MAX_FREE_WALLET_CHECKS}
+    _BADGE_CACHE.set(email, badge, ttl=SUBSCRIPTION_CACHE_TTL if premium else None)
+    return badge
+
+def get_user_context(email: NormalizedEmail) -> tuple[bool, dict]:
+    """(premium, limits badge) for a page render: badge cache, else one narrow SELECT."""
+    badge = _BADGE_CACHE.get(email)
+    if badge is None:
+        with _conn() as conn:
+            row = conn.execute(
+                "SELECT subscription,subscription_until,wallet_checks_today,last_wallet_check "
+                "FROM users WHERE email=?", (email,)
+            ).fetchone()
+        badge = get_limits_badge(email, row)
+    return badge["is_premium"], badge
@@ -4,18 +4,25 @@ from dotenv import load_dotenv
 
 load_dotenv(dotenv_path=Path(__file__).resolve().parents[1] / ".env")
 
-from fastapi import FastAPI, Request, Form, Header
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi import FastAPI, Request, Form, Header, Depends
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.templating import Jinja2Templates
-import os, hmac, hashlib, json
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+import hmac, hashlib, asyncio
+from contextlib import asynccontextmanager, suppress
+from dataclasses import dataclass
+from urllib.parse import quote
+import orjson
 
 from app.database import (
     init_db,
     set_subscription,
     try_consume_wallet_check,
     get_limits_badge,
-    has_active_subscription,
+    get_cached_badge,
+    get_user_context,
 )
 
 from app.auth import (
@@ -23,11 +30,13 @@ from app.auth import (
     authenticate_user,
     set_login_cookie,
     clear_login_cookie,
-    is_logged_in,
     current_user,
     is_admin,
+    _norm_email,
 )
 
+from app.cache import cached
+from app.config import get_settings
 from app.checks import wallet_check
 from app.sources import (
     token_dex_info,
@@ -35,92 +44,225 @@ from app.sources import (
     etherscan_contract_source,
     create_nowpayments_invoice,
     group_quick_check,
+    get_client,
+    close_client,
 )
 
-app = FastAPI(title="ScamCheck")
-app.mount("/static", StaticFiles(directory="app/static"), name="static")
-templates = Jinja2Templates(directory="app/templates")
+settings = get_settings()
+
+
+class OrjsonResponse(JSONResponse):
+    """JSONResponse serialized with orjson (FastAPI's own ORJSONResponse is deprecated)."""
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
+
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles with a Cache-Control header (assets are not fingerprinted, so no 'immutable')."""
+
+    def file_response(self, *args, **kwargs):
+        resp = super().file_response(*args, **kwargs)
+        resp.headers.setdefault("Cache-Control", f"public, max-age={settings.static_max_age}")
+        return resp
+
+
+# Compiled page templates: render without get_template() and TemplateResponse
+_TPL = {}
+
+
+def _warm_templates():
+    for name in templates.env.list_templates(extensions=["html"]):
+        tpl = templates.env.get_template(name)
+        if not settings.templates_auto_reload:
+            _TPL[name] = tpl
+
+
+async def _warm_group_check():
+    try:
+        await group_quick_check("https://t.me/telegram")
+    except Exception:
+        pass
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await asyncio.to_thread(init_db)
+    get_client()
+    _warm_templates()
+    # first /group and /api/* skip DNS/TLS to t.me; runs in the background, startup doesn't wait on the network
+    warmup = asyncio.create_task(_warm_group_check())
+    try:
+        yield
+    finally:
+        # the probe must not outlive the client closed below
+        warmup.cancel()
+        with suppress(asyncio.CancelledError):
+            await warmup
+        await close_client()
+
+
+app = FastAPI(title="ScamCheck", default_response_class=OrjsonResponse, lifespan=lifespan)
+app.add_middleware(GZipMiddleware, minimum_size=500)
+app.mount("/static", CachedStaticFiles(directory="app/static"), name="static")
+
+# Templates: on-disk bytecode cache; auto_reload only when explicitly enabled (dev)
+templates = Jinja2Templates(env=Environment(
+    loader=FileSystemLoader("app/templates"),
+    autoescape=True,
+    auto_reload=settings.templates_auto_reload,
+    bytecode_cache=FileSystemBytecodeCache(),
+))
+
+
+def render(name: str, context: dict, status_code: int = 200) -> HTMLResponse:
+    """Renders a page straight into an HTMLResponse; context must carry "request" (url_for)."""
+    tpl = _TPL.get(name) or templates.env.get_template(name)
+    return HTMLResponse(tpl.render(context), status_code=status_code)
 
-init_db()
 
 # --------- helpers ----------
-def require_login(request: Request):
-    """Redirects to /register if the user is not logged in."""
-    if not is_logged_in(request):
-        return RedirectResponse(url="/register?next=/", status_code=302)
+def with_msg(path: str, msg: str) -> str:
+    """Redirect target with a properly URL-encoded ?msg= flash."""
+    return f"{path}?msg={quote(msg, safe='')}"
+
+
+WELCOME_URL = with_msg("/", "Welcome")
+LOGIN_FAILED_URL = with_msg("/login", "Invalid email or password")
+LOGGED_OUT_URL = with_msg("/login", "Logged out")
+FORBIDDEN_URL = with_msg("/subscription", "Forbidden")
+
+
+class RedirectException(Exception):
+    """Raised from dependencies to short-circuit a request into a 302."""
+
+    def __init__(self, url: str):
+        self.url = url
 
 
-def has_premium(email: str | None) -> bool:
-    """Admins are always premium; otherwise check subscription."""
-    if is_admin(email):
-        return True
-    return bool(email and has_active_subscription(email))
+@app.exception_handler(RedirectException)
+async def _redirect_exception_handler(request: Request, exc: RedirectException):
+    return RedirectResponse(url=exc.url, status_code=302)
+
+
+async def logged_in_email(request: Request) -> str:
+    """Dependency: the session email, or a redirect to /register if not logged in."""
+    email = current_user(request)
+    if not email:
+        raise RedirectException("/register?next=/")
+    return email
+
+
+@dataclass
+class PageCtx:
+    email: str
+    is_admin: bool
+    premium: bool
+    badge: dict
+
+
+async def get_ctx(request: Request, email: str = Depends(logged_in_email)) -> PageCtx:
+    """
+    Per-request user context, computed once and kept on request.state.
+    Admins are always premium; otherwise premium comes from the badge.
+    """
+    ctx = getattr(request.state, "ctx", None)
+    if ctx is None:
+        badge = get_cached_badge(email)
+        if badge is None:
+            sub, badge = await asyncio.to_thread(get_user_context, email)
+        else:
+            sub = badge["is_premium"]
+        admin = is_admin(email)
+        ctx = PageCtx(email, admin, admin or sub, badge)
+        request.state.ctx = ctx
+    return ctx
+
+
+# Weak ETags for pages that depend only on the user context; the template
+# mtimes are part of the tag so a deploy invalidates browser copies.
+_TEMPLATES_VERSION = str(max(p.stat().st_mtime_ns for p in Path("app/templates").glob("*.html")))
+
+
+def page_etag(ctx: PageCtx, *parts) -> str:
+    key = "|".join(map(str, (_TEMPLATES_VERSION, ctx.email, ctx.premium, ctx.is_admin, ctx.badge, *parts)))
+    return f'W/"{hashlib.blake2b(key.encode(), digest_size=8).hexdigest()}"'
+
+
+def not_modified(request: Request, etag: str) -> Response | None:
+    """304 if the browser already holds this ETag, else None."""
+    inm = request.headers.get("if-none-match")
+    if inm and etag in (t.strip() for t in inm.split(",")):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+    return None
+
+
+def with_etag(resp: Response, etag: str) -> Response:
+    resp.headers["ETag"] = etag
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
 
 
 # --------- pages ----------
 @app.get("/", response_class=HTMLResponse)
-async def home(request: Request, msg: str | None = None):
-    redir = require_login(request)
-    if redir:
-        return redir
-    email = current_user(request)
-    return templates.TemplateResponse(
+async def home(request: Request, msg: str | None = None, ctx: PageCtx = Depends(get_ctx)):
+    etag = page_etag(ctx, "index.html", msg)
+    if resp := not_modified(request, etag):
+        return resp
+    return with_etag(render(
         "index.html",
-        {"request": request, "result": None, "user": email, "msg": msg, "badge": get_limits_badge(email)},
-    )
+        {"request": request, "result": None, "user": ctx.email, "msg": msg, "badge": ctx.badge},
+    ), etag)
 
 
 @app.post("/check_wallet", response_class=HTMLResponse)
-async def check_wallet_route(request: Request, address: str = Form(...)):
+async def check_wallet_route(request: Request, address: str = Form(...), ctx: PageCtx = Depends(get_ctx)):
     """
     Wallet checks: Free plan is limited per day; Premium/Admin is unlimited.
     The quota applies ONLY to wallet checks (not to token/contract pages).
     """
-    redir = require_login(request)
-    if redir:
-        return redir
-
-    email = current_user(request)
+    email = ctx.email
+    badge = ctx.badge
     msg = None
 
-    # Apply quota only if NOT admin and NO active subscription
-    if not is_admin(email) and not has_active_subscription(email):
-        ok, left_after, err = try_consume_wallet_check(email)
+    # Quota only for free users; premium/admin requests do no counter I/O at all
+    if not ctx.premium:
+        # premium already answered by ctx; the badge cache covers the check inside
+        ok, left_after, err = await asyncio.to_thread(try_consume_wallet_check, email)
         if not ok:
-            return templates.TemplateResponse(
+            return render(
                 "index.html",
                 {
                     "request": request,
                     "result": None,
                     "user": email,
                     "msg": err or "Free limit reached. Upgrade to Premium for unlimited checks.",
-                    "badge": get_limits_badge(email),
+                    "badge": badge,
                 },
                 status_code=200,
             )
-        else:
+        if left_after >= 0:
             msg = f"Free checks left today: {left_after}"
+        badge = get_cached_badge(email) or await asyncio.to_thread(get_limits_badge, email)  # counter changed
 
-    result = await wallet_check(address)
-    return templates.TemplateResponse(
+    result = await cached(wallet_check, address.strip(), ttl=300)
+    return render(
         "index.html",
-        {"request": request, "result": result, "user": email, "msg": msg, "badge": get_limits_badge(email)},
+        {"request": request, "result": result, "user": email, "msg": msg, "badge": badge},
     )
 
 
 @app.get("/token", response_class=HTMLResponse)
-async def token_page(request: Request, token: str | None = None, chain: str = "eth"):
-    redir = require_login(request)
-    if redir:
-        return redir
-    email = current_user(request)
-    prem = has_premium(email)
+async def token_page(request: Request, token: str | None = None, chain: str = "eth", ctx: PageCtx = Depends(get_ctx)):
+    email, prem, badge = ctx.email, ctx.premium, ctx.badge
     info = None
     hp = None
     if token and prem:
-        info = await token_dex_info(token)
-        hp = await token_honeypot_check(token, chain=chain)
-    return templates.TemplateResponse(
+        info, hp = await asyncio.gather(
+            cached(token_dex_info, token, ttl=60),
+            cached(token_honeypot_check, token, chain=chain, ttl=60),
+        )
+    return render(
         "token.html",
         {
             "request": request,
@@ -130,22 +272,23 @@ async def token_page(request: Request, token: str | None = None, chain: str = "e
             "hp": hp,
             "token": token,
             "chain": chain,
-            "badge": get_limits_badge(email),
+            "badge": badge,
         },
     )
 
 
+def _contract_ttl(res: dict) -> float:
+    # verified source is immutable; "not verified" can change any minute
+    return 3600 if res.get("verified") else 300
+
+
 @app.get("/contract", response_class=HTMLResponse)
-async def contract_page(request: Request, address: str | None = None, chain_code: str = "ETH"):
-    redir = require_login(request)
-    if redir:
-        return redir
-    email = current_user(request)
-    prem = has_premium(email)
+async def contract_page(request: Request, address: str | None = None, chain_code: str = "ETH", ctx: PageCtx = Depends(get_ctx)):
+    email, prem, badge = ctx.email, ctx.premium, ctx.badge
     res = None
     if address and prem:
-        res = await etherscan_contract_source(address, chain_code=chain_code)
-    return templates.TemplateResponse(
+        res = await cached(etherscan_contract_source, address, chain_code=chain_code, ttl=_contract_ttl)
+    return render(
         "contract.html",
         {
             "request": request,
@@ -154,48 +297,45 @@ async def contract_page(request: Request, address: str | None = None, chain_code
             "result": res,
             "address": address,
             "chain_code": chain_code,
-            "badge": get_limits_badge(email),
+            "badge": badge,
         },
     )
 
 
 @app.get("/group", response_class=HTMLResponse)
-async def group_page(request: Request, link: str | None = None):
-    redir = require_login(request)
-    if redir:
-        return redir
-    email = current_user(request)
-    prem = has_premium(email)
+async def group_page(request: Request, link: str | None = None, ctx: PageCtx = Depends(get_ctx)):
+    email, prem, badge = ctx.email, ctx.premium, ctx.badge
     result = None
     if prem and link:
-        result = await group_quick_check(link)
-    return templates.TemplateResponse(
+        result = await cached(group_quick_check, link, ttl=300)
+    return render(
         "group.html",
-        {"request": request, "user": email, "sub": prem, "result": result, "link": link, "badge": get_limits_badge(email)},
+        {"request": request, "user": email, "sub": prem, "result": result, "link": link, "badge": badge},
     )
 
 
 @app.get("/knowledge", response_class=HTMLResponse)
-async def knowledge_page(request: Request):
-    redir = require_login(request)
-    if redir:
-        return redir
-    email = current_user(request)
-    return templates.TemplateResponse("knowledge.html", {"request": request, "user": email, "badge": get_limits_badge(email)})
+async def knowledge_page(request: Request, ctx: PageCtx = Depends(get_ctx)):
+    etag = page_etag(ctx, "knowledge.html")
+    if resp := not_modified(request, etag):
+        return resp
+    return with_etag(
+        render("knowledge.html", {"request": request, "user": ctx.email, "badge": ctx.badge}),
+        etag,
+    )
 
 
 # --------- subscription ----------
 @app.get("/subscription", response_class=HTMLResponse)
-async def subscription_page(request: Request):
-    redir = require_login(request)
-    if redir:
-        return redir
-    email = current_user(request)
-    prem = has_premium(email)
-    return templates.TemplateResponse(
+async def subscription_page(request: Request, ctx: PageCtx = Depends(get_ctx)):
+    email, prem, badge = ctx.email, ctx.premium, ctx.badge
+    etag = page_etag(ctx, "subscription.html")
+    if resp := not_modified(request, etag):
+        return resp
+    return with_etag(render(
         "subscription.html",
-        {"request": request, "user": email, "sub": prem, "is_admin": is_admin(email), "pay_error": None, "badge": get_limits_badge(email)},
-    )
+        {"request": request, "user": email, "sub": prem, "is_admin": ctx.is_admin, "pay_error": None, "badge": badge},
+    ), etag)
 
 
 @app.post("/subscription/demo-activate")
@@ -204,8 +344,8 @@ async def subscription_demo_activate(request: Request):
     if not email:
         return RedirectResponse(url="/login", status_code=302)
     if not is_admin(email):                        # <-- критично
-        return RedirectResponse(url="/subscription?msg=Forbidden", status_code=302)
-    set_subscription(email, 1)                     # +SUBSCRIPTION_DAYS (30)
+        return RedirectResponse(url=FORBIDDEN_URL, status_code=302)
+    await asyncio.to_thread(set_subscription, email, 1)  # +SUBSCRIPTION_DAYS (30)
     return RedirectResponse(url="/subscription", status_code=302)
 
 
@@ -217,16 +357,16 @@ async def subscription_pay(request: Request):
 
     res = await create_nowpayments_invoice(email)
     if not res.get("ok"):
-        prem = has_premium(email)
-        return templates.TemplateResponse(
+        ctx = await get_ctx(request, email)
+        return render(
             "subscription.html",
             {
                 "request": request,
                 "user": email,
-                "sub": prem,
-                "is_admin": is_admin(email),
+                "sub": ctx.premium,
+                "is_admin": ctx.is_admin,
                 "pay_error": str(res.get("error")),
-                "badge": get_limits_badge(email),
+                "badge": ctx.badge,
             },
             status_code=400,
         )
@@ -240,95 +380,96 @@ async def subscription_success(request: Request):
     This page only says "Thanks"; subscription is extended ONLY via IPN after verified payment.
     """
     email = current_user(request)
-    return templates.TemplateResponse("subscription_success.html", {"request": request, "user": email})
+    return render("subscription_success.html", {"request": request, "user": email})
 
 
-@app.post("/subscription/ipn")
+@app.post("/subscription/ipn", response_class=OrjsonResponse)
 async def subscription_ipn(request: Request, x_nowpayments_sig: str = Header(None)):
     """
     NOWPayments IPN handler with HMAC verification.
     We extend subscription when status is 'finished' or 'confirmed'.
     """
-    secret = os.getenv("NOWPAYMENTS_IPN_SECRET", "")
     body = await request.body()
 
-    if not secret:
-        return {"ok": False, "error": "no secret configured"}
-
-    # HMAC-SHA512 signature check
-    h = hmac.new(secret.encode(), body, hashlib.sha512).hexdigest()
-    if h != (x_nowpayments_sig or "").lower():
-        return {"ok": False, "error": "bad signature"}
-
-    data = json.loads(body.decode())
+    if not settings.nowpayments_ipn_secret:
+        return OrjsonResponse({"ok": False, "error": "no secret configured"})
+
+    # HMAC-SHA512 signature check; malformed headers are rejected before hashing the body
+    if not x_nowpayments_sig or len(x_nowpayments_sig) != 128:
+        return OrjsonResponse({"ok": False, "error": "bad signature"})
+    try:
+        sig = bytes.fromhex(x_nowpayments_sig)
+    except ValueError:
+        return OrjsonResponse({"ok": False, "error": "bad signature"})
+    h = hmac.new(settings.nowpayments_ipn_secret, body, hashlib.sha512).digest()
+    if not hmac.compare_digest(h, sig):
+        return OrjsonResponse({"ok": False, "error": "bad signature"})
+
+    try:
+        data = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        data = None
+    if not isinstance(data, dict):
+        return OrjsonResponse({"ok": False, "error": "bad payload"})
 
     payment_status = (data.get("payment_status") or "").lower()
     order_id = str(data.get("order_id") or "")
 
-    # Extract email from order_id. Our format is "sub_<email>"
-    email = ""
+    # Extract email from order_id. Our format is "sub_<email>_<ts>_<rand>"
+    email = None
     if order_id.startswith("sub_"):
-        try:
-            email = order_id.split("_", 1)[1]
-        except Exception:
-            email = ""
+        email = _norm_email(order_id[len("sub_"):].rsplit("_", 2)[0])
 
     if payment_status in ("finished", "confirmed") and email:
         # NOTE: If you need strict idempotency, add a payments table and store processed payment_id.
-        set_subscription(email, 1)  # +SUBSCRIPTION_DAYS (default 30)
+        await asyncio.to_thread(set_subscription, email, 1)  # +SUBSCRIPTION_DAYS (default 30)
 
-    return {"ok": True}
+    return OrjsonResponse({"ok": True})
 
 
 # --------- auth ----------
 @app.get("/login", response_class=HTMLResponse)
 async def login_page(request: Request, msg: str | None = None):
-    return templates.TemplateResponse("login.html", {"request": request, "msg": msg})
+    return render("login.html", {"request": request, "msg": msg})
 
 
 @app.get("/register", response_class=HTMLResponse)
 async def register_page(request: Request, msg: str | None = None):
-    return templates.TemplateResponse("register.html", {"request": request, "msg": msg})
+    return render("register.html", {"request": request, "msg": msg})
 
 
 @app.post("/register")
 async def register(email: str = Form(...), password: str = Form(...)):
-    ok, msg = register_user(email, password)
+    ok, msg = await asyncio.to_thread(register_user, email, password)
     if not ok:
-        return RedirectResponse(url=f"/register?msg={msg.replace(' ', '%20')}", status_code=302)
-    resp = RedirectResponse(url="/?msg=Welcome", status_code=302)
+        return RedirectResponse(url=with_msg("/register", msg), status_code=302)
+    resp = RedirectResponse(url=WELCOME_URL, status_code=302)
     set_login_cookie(resp, email)
     return resp
 
 
 @app.post("/login")
 async def login(email: str = Form(...), password: str = Form(...)):
-    ok, msg = authenticate_user(email, password)
+    ok, msg = await asyncio.to_thread(authenticate_user, email, password)
     if not ok:
-        return RedirectResponse(url="/login?msg=Invalid%20email%20or%20password", status_code=302)
-    resp = RedirectResponse(url="/?msg=Welcome", status_code=302)
+        return RedirectResponse(url=LOGIN_FAILED_URL, status_code=302)
+    resp = RedirectResponse(url=WELCOME_URL, status_code=302)
     set_login_cookie(resp, email)
     return resp
 
 
 @app.get("/logout")
 async def logout():
-    resp = RedirectResponse(url="/login?msg=Logged%20out", status_code=302)
+    resp = RedirectResponse(url=LOGGED_OUT_URL, status_code=302)
     clear_login_cookie(resp)
     return resp
 
 
 # --------- public JSON API ----------
-@app.get("/api/telegram/check")
-async def api_telegram_check(url: str):
-    return await group_quick_check(url)
-
-
-@app.get("/api/group/check")
-async def api_group_check(url: str):
-    return await group_quick_check(url)
+async def _group_check_api(url: str):
+    return OrjsonResponse(await cached(group_quick_check, url, ttl=300))
 
 
-@app.get("/api/check")
-async def api_check(url: str):
-    return await group_quick_check(url)
+# one handler for all three paths (old paths kept for existing clients)
+for _path in ("/api/telegram/check", "/api/group/check", "/api/check"):
+    app.add_api_route(_path, _group_check_api, methods=["GET"], response_class=OrjsonResponse)
@@ -1,9 +1,12 @@
 # app/sources.py
 import os
 import re
+import asyncio
 import time
 import uuid
+from urllib.parse import quote
 import httpx
+import orjson
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -25,78 +28,140 @@ SCAN_BASE = {
 }
 
 # Common HTTP settings
-DEFAULT_TIMEOUT = 15
+DEFAULT_TIMEOUT = httpx.Timeout(15, connect=5)
+# Hard cap on the whole group_quick_check probe, whatever the per-request timeouts
+GROUP_CHECK_BUDGET = float(os.getenv("GROUP_CHECK_BUDGET", "8"))
 UA = {"User-Agent": "ScamCheck/1.0 (+support@scamcheck.app)"}
 
+# Shared client: keep-alive connections are reused across requests
+_CLIENT: httpx.AsyncClient | None = None
+
+
+def get_client() -> httpx.AsyncClient:
+    global _CLIENT
+    if _CLIENT is None or _CLIENT.is_closed:
+        # HTTP/2: explorers sit behind Cloudflare, parallel calls multiplex on one connection
+        _CLIENT = httpx.AsyncClient(
+            http2=True,
+            timeout=DEFAULT_TIMEOUT,
+            headers=UA,
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+        )
+    return _CLIENT
+
+
+async def close_client() -> None:
+    global _CLIENT
+    if _CLIENT is not None:
+        await _CLIENT.aclose()
+        _CLIENT = None
+
+
+def _loads(r: httpx.Response):
+    """Parses a JSON body straight from bytes (no str decode, orjson instead of json)."""
+    return orjson.loads(r.content)
+
 
 # ---------------- Wallet (EVM) ----------------
+_ADDR_RE = re.compile(r"0x[0-9a-fA-F]{40}")
+
+
+async def _evm_balance_wei(client: httpx.AsyncClient, base: str, addr: str) -> int | None:
+    params = {"module": "account", "action": "balance", "address": addr, "tag": "latest", "apikey": ETHERSCAN_API_KEY}
+    bal = _loads(await client.get(base, params=params))
+    try:
+        return int(bal.get("result", "0"))
+    except Exception:
+        return None  # e.g. "Max rate limit reached" instead of a number
+
+
+async def _evm_tx_count(client: httpx.AsyncClient, base: str, addr: str) -> int | None:
+    params = {"module": "account", "action": "txlist", "address": addr, "page": 1, "offset": 1, "sort": "desc",
+              "apikey": ETHERSCAN_API_KEY}
+    tx = _loads(await client.get(base, params=params))
+    return len(tx["result"]) if isinstance(tx.get("result"), list) else None
+
+
 async def check_evm_wallet(addr: str, chain_code: str = "ETH") -> dict:
+    if not _ADDR_RE.fullmatch(addr or ""):
+        return {"ok": False, "error": "Invalid address"}
     base = SCAN_BASE.get(chain_code, SCAN_BASE["ETH"])
     if not ETHERSCAN_API_KEY:
         return {"ok": False, "error": "ETHERSCAN_API_KEY missing"}
 
-    async with httpx.AsyncClient(timeout=DEFAULT_TIMEOUT, headers=UA) as client:
-        bal_url = f"{base}?module=account&action=balance&address={addr}&tag=latest&apikey={ETHERSCAN_API_KEY}"
-        bal = (await client.get(bal_url)).json()
-        try:
-            balance_wei = int(bal.get("result", "0"))
-        except Exception:
-            balance_wei = 0
+    client = get_client()
+    # balance and txlist are independent: one round trip instead of two
+    balance_wei, tx_count = await asyncio.gather(
+        _evm_balance_wei(client, base, addr),
+        _evm_tx_count(client, base, addr),
+        return_exceptions=True,
+    )
+    # a failed call leaves its field None (unknown, not zero); both failing is an error
+    err = balance_wei if isinstance(balance_wei, Exception) else tx_count
+    if isinstance(balance_wei, Exception):
+        balance_wei = None
+    if isinstance(tx_count, Exception):
+        tx_count = None
+    if balance_wei is None and tx_count is None:
+        reason = type(err).__name__ if isinstance(err, Exception) else "bad explorer reply"
+        return {"ok": False, "error": f"Explorer request failed: {reason}"}
+    balance_native = balance_wei / 1e18 if balance_wei is not None else None
+    return {"ok": True, "balance_wei": balance_wei, "balance_native": balance_native, "tx_count": tx_count}
 
-        tx_url = f"{base}?module=account&action=txlist&address={addr}&page=1&offset=1&sort=desc&apikey={ETHERSCAN_API_KEY}"
-        tx = (await client.get(tx_url)).json()
-        tx_count = len(tx.get("result", [])) if isinstance(tx.get("result"), list) else 0
 
-        return {"ok": True, "balance_wei": balance_wei, "balance_native": balance_wei / 1e18, "tx_count": tx_count}
+# ---------------- Token: DEX info ----------------
+def _liquidity_usd(pair: dict) -> float:
+    # DexScreener may send "liquidity": null for fresh pairs
+    return (pair.get("liquidity") or {}).get("usd") or 0
 
 
-# ---------------- Token: DEX info ----------------
 async def token_dex_info(token_address: str) -> dict:
-    url = f"https://api.dexscreener.com/latest/dex/tokens/{token_address}"
-    async with httpx.AsyncClient(timeout=DEFAULT_TIMEOUT, headers=UA) as client:
-        r = await client.get(url)
-        if r.status_code != 200:
-            return {"ok": False, "error": f"dexscreener HTTP {r.status_code}"}
-        data = r.json()
-        pairs = data.get("pairs") or []
-        best = None
-        for p in pairs:
-            if best is None or (p.get("liquidity", {}).get("usd", 0) > best.get("liquidity", {}).get("usd", 0)):
-                best = p
-        if not best:
-            return {"ok": True, "found": False}
-        return {
-            "ok": True,
-            "found": True,
-            "pair": {
-                "dex": best.get("dexId"),
-                "base": best.get("baseToken", {}).get("symbol"),
-                "quote": best.get("quoteToken", {}).get("symbol"),
-                "priceUsd": best.get("priceUsd"),
-                "liquidityUsd": best.get("liquidity", {}).get("usd"),
-                "fdv": best.get("fdv"),
-                "url": best.get("url"),
-            },
-        }
+    url = f"https://api.dexscreener.com/latest/dex/tokens/{quote(token_address, safe='')}"
+    client = get_client()
+    r = await client.get(url)
+    if r.status_code != 200:
+        return {"ok": False, "error": f"dexscreener HTTP {r.status_code}"}
+    data = _loads(r)
+    best = max(data.get("pairs") or [], key=_liquidity_usd, default=None)
+    if not best:
+        return {"ok": True, "found": False}
+    return {
+        "ok": True,
+        "found": True,
+        "pair": {
+            "dex": best.get("dexId"),
+            "base": best.get("baseToken", {}).get("symbol"),
+            "quote": best.get("quoteToken", {}).get("symbol"),
+            "priceUsd": best.get("priceUsd"),
+            "liquidityUsd": (best.get("liquidity") or {}).get("usd"),
+            "fdv": best.get("fdv"),
+            "url": best.get("url"),
+        },
+    }
 
 
 # ---------------- Token: Honeypot check ----------------
 async def token_honeypot_check(token_address: str, chain: str = "eth") -> dict:
-    url = f"https://api.honeypot.is/v2/IsHoneypot?address={token_address}&chain={chain}"
-    async with httpx.AsyncClient(timeout=DEFAULT_TIMEOUT, headers=UA) as client:
-        r = await client.get(url)
-        try:
-            data = r.json()
-        except Exception:
-            return {"ok": False, "error": f"honeypot HTTP {r.status_code}"}
-        sim = data.get("simulation", {})
-        buy = sim.get("buyTax")
-        sell = sim.get("sellTax")
-        is_hp = bool(data.get("honeypotResult", {}).get("isHoneypot", False))
-        return {"ok": True, "buyTax": buy, "sellTax": sell, "isHoneypot": is_hp, "raw": data}
+    client = get_client()
+    r = await client.get("https://api.honeypot.is/v2/IsHoneypot", params={"address": token_address, "chain": chain})
+    try:
+        data = _loads(r)
+    except Exception:
+        return {"ok": False, "error": f"honeypot HTTP {r.status_code}"}
+    sim = data.get("simulation", {})
+    buy = sim.get("buyTax")
+    sell = sim.get("sellTax")
+    is_hp = bool(data.get("honeypotResult", {}).get("isHoneypot", False))
+    return {"ok": True, "buyTax": buy, "sellTax": sell, "isHoneypot": is_hp}
 
 
 # ---------------- Contract source (Etherscan family) ----------------
+DANGER_PATTERNS = ("blacklist", "whitelist", "pause", "mint(", "setfee", "owner()", "transferownership")
+# one case-insensitive pass over the source instead of lower() + 7 substring scans;
+# the lookahead makes matches zero-width so overlapping hits are all reported
+_DANGER_RE = re.compile("(?=(" + "|".join(map(re.escape, DANGER_PATTERNS)) + "))", re.I)
+
+
 async def etherscan_contract_source(address: str, chain_code: str = "ETH") -> dict:
     name_map = {
         "ETHEREUM": "ETH",
@@ -113,7 +178,7 @@ async def etherscan_contract_source(address: str, chain_code: str = "ETH") -> di
     key = name_map.get((chain_code or "ETH").upper(), "ETH")
     base = SCAN_BASE.get(key, SCAN_BASE["ETH"])
 
-    if not (isinstance(address, str) and address.startswith("0x") and len(address) == 42):
+    if not (isinstance(address, str) and _ADDR_RE.fullmatch(address)):
         return {
             "ok": True,
             "verified": False,
@@ -127,9 +192,8 @@ async def etherscan_contract_source(address: str, chain_code: str = "ETH") -> di
         return {"ok": True, "verified": False, "flags": [], "compiler": None, "license": None, "error": "ETHERSCAN_API_KEY missing"}
 
     try:
-        async with httpx.AsyncClient(timeout=DEFAULT_TIMEOUT, headers=UA) as client:
-            url = f"{base}?module=contract&action=getsourcecode&address={address}&apikey={ETHERSCAN_API_KEY}"
-            r = await client.get(url)
+        params = {"module": "contract", "action": "getsourcecode", "address": address, "apikey": ETHERSCAN_API_KEY}
+        r = await get_client().get(base, params=params)
     except Exception as e:
         return {"ok": True, "verified": False, "flags": [], "compiler": None, "license": None, "error": f"Explorer request failed: {type(e).__name__}"}
 
@@ -137,7 +201,7 @@ async def etherscan_contract_source(address: str, chain_code: str = "ETH") -> di
         return {"ok": True, "verified": False, "flags": [], "compiler": None, "license": None, "error": f"{key}scan HTTP {r.status_code}"}
 
     try:
-        data = r.json()
+        data = _loads(r)
     except Exception:
         return {"ok": True, "verified": False, "flags": [], "compiler": None, "license": None, "error": "Bad JSON from explorer"}
 
@@ -159,10 +223,8 @@ async def etherscan_contract_source(address: str, chain_code: str = "ETH") -> di
 
     flags = []
     if verified:
-        lowersrc = (src or "").lower()
-        for p in ["blacklist", "whitelist", "pause", "mint(", "setfee", "owner()", "transferownership"]:
-            if p in lowersrc:
-                flags.append(p)
+        found = {m.lower() for m in _DANGER_RE.findall(src)}
+        flags = [p for p in DANGER_PATTERNS if p in found]
 
     return {
         "ok": True,
@@ -204,126 +266,129 @@ async def create_nowpayments_invoice(email: str) -> dict:
 
     headers = {"x-api-key": NOWPAYMENTS_API_KEY, "Content-Type": "application/json"}
 
-    async with httpx.AsyncClient(timeout=DEFAULT_TIMEOUT, headers=headers) as client:
-        r = await client.post("https://api.nowpayments.io/v1/invoice", json=payload)
-        if r.status_code != 200:
-            try:
-                data = r.json()
-            except Exception:
-                data = {"error": f"NOWPayments HTTP {r.status_code}"}
-            return {"ok": False, "error": data}
-
+    client = get_client()
+    r = await client.post("https://api.nowpayments.io/v1/invoice", json=payload, headers=headers)
+    if r.status_code != 200:
         try:
-            data = r.json()
+            data = _loads(r)
         except Exception:
-            return {"ok": False, "error": "NOWPayments returned invalid JSON"}
-
-        invoice_url = data.get("invoice_url")
-        if invoice_url:
-            return {"ok": True, "url": invoice_url, "id": data.get("id"), "order_id": order_id}
+            data = {"error": f"NOWPayments HTTP {r.status_code}"}
         return {"ok": False, "error": data}
 
+    try:
+        data = _loads(r)
+    except Exception:
+        return {"ok": False, "error": "NOWPayments returned invalid JSON"}
+
+    invoice_url = data.get("invoice_url")
+    if invoice_url:
+        return {"ok": True, "url": invoice_url, "id": data.get("id"), "order_id": order_id}
+    return {"ok": False, "error": data}
+
 
 # ---------------- Telegram/Discord group quick-check (mannequin rules) ----------------
 TG_USER_RE = re.compile(r"(?:https?://)?(?:t\.me|telegram\.me)/([A-Za-z0-9_]{3,})$")
 TG_JOIN_RE = re.compile(r"(?:https?://)?(?:t\.me|telegram\.me)/(?:\+|joinchat/)([A-Za-z0-9_\-]{6,})")
 DC_INV_RE = re.compile(r"(?:https?://)?(?:discord\.gg|discord\.com/invite)/([A-Za-z0-9\-]+)")
+# t.me page markers, matched on the raw bytes (no decode, no lower())
+_TG_CHAT_RE = re.compile(rb"tgme_channel_history|tgme_channel_info|join channel|join group", re.I)
+_TG_NOT_FOUND_RE = re.compile(rb"not found", re.I)
 
 
-def _label_pack(r: int):
-    if r >= 70:
-        return ("Risk", "red", "High probability of invalid or unsafe link.")
-    if r >= 40:
-        return ("Caution", "yellow", "Neutral risk level.")
-    return ("Safe", "green", "No obvious red flags found.")
+def _load_scam_invites() -> frozenset[str]:
+    """Known-bad invite codes (Discord + t.me/+), one per line; '#' starts a comment."""
+    try:
+        with open(os.getenv("SCAM_INVITES_FILE", "scam_invites.txt"), encoding="utf-8") as f:
+            return frozenset(c for c in (line.split("#", 1)[0].strip() for line in f) if c)
+    except OSError:
+        return frozenset()
 
 
-async def group_quick_check(url: str) -> dict:
-    u = (url or "").strip()
-    if not u:
-        return {"ok": False, "error": "Empty link."}
+# Invites already classified as scams: answered without any upstream call
+_SCAM_INVITES = _load_scam_invites()
 
-    signals, tips = [], []
 
-    # ---- Discord (invites) ----
-    m_dc = DC_INV_RE.search(u)
-    if m_dc:
-        dc_code = m_dc.group(1)
-        signals.append("Detected platform: Discord")
-        async with httpx.AsyncClient(timeout=DEFAULT_TIMEOUT, headers=UA, follow_redirects=True) as client:
-            api = f"https://discord.com/api/v9/invites/{dc_code}?with_counts=true&with_expiration=true"
-            r = await client.get(api)
-            if r.status_code == 404:
-                return {
-                    "ok": True,
-                    "platform": "Discord",
-                    "url": u,
-                    "risk": 85,
-                    "label": "Risk",
-                    "color": "red",
-                    "summary": "Discord invite is invalid or expired.",
-                    "signals": signals + ["Discord API: invite not found (404)"],
-                    "tips": ["Ask admins for a fresh invite", "Check official site/socials for links"],
-                }
-            if r.status_code != 200:
-                return {
-                    "ok": True,
-                    "platform": "Discord",
-                    "url": u,
-                    "risk": 55,
-                    "label": "Caution",
-                    "color": "yellow",
-                    "summary": f"Discord API returned {r.status_code}",
-                    "signals": signals,
-                    "tips": ["Try again later"],
-                }
-            data = r.json()
-            approx = int(data.get("approximate_member_count") or 0)
-            online = int(data.get("approximate_presence_count") or 0)
-            risk = 50 if approx >= 100 else (75 if approx < 10 else 55)
-            L, C, S = _label_pack(risk)
-            return {
-                "ok": True,
-                "platform": "Discord",
-                "url": u,
-                "risk": risk,
-                "label": L,
-                "color": C,
-                "summary": S,
-                "signals": signals + [f"Members ~ {approx}, Online ~ {online}"],
-                "tips": ["Check pinned rules and roles", "Do not DM unknown users"],
-            }
-
-    # ---- Telegram ----
-    m_tg_join = TG_JOIN_RE.search(u)
-    m_tg_user = TG_USER_RE.search(u)
+def _known_scam(u: str, platform: str, signals: list) -> dict:
+    risk = 95
+    L, C, S = _label_pack(risk)
+    return {
+        "ok": True,
+        "platform": platform,
+        "url": u,
+        "risk": risk,
+        "label": L,
+        "color": C,
+        "summary": "Invite is on the known-scam list.",
+        "signals": signals + ["Invite code previously flagged as scam"],
+        "tips": ["Do not join or send funds", "Use links from the project's official site only"],
+    }
 
-    if not (m_tg_join or m_tg_user):
-        return {"ok": False, "error": "Provide a valid Telegram link (t.me/<username> or t.me/+invite)."}
 
-    signals.append("Detected platform: Telegram")
+# (label, color, summary) per risk decade: 0-39 Safe, 40-69 Caution, 70-100 Risk
+_LABELS = tuple(
+    ("Safe", "green", "No obvious red flags found.") if i < 4
+    else ("Caution", "yellow", "Neutral risk level.") if i < 7
+    else ("Risk", "red", "High probability of invalid or unsafe link.")
+    for i in range(11)
+)
 
-    if m_tg_join:
-        risk = 50
-        L, C, S = _label_pack(risk)
+
+def _label_pack(r: int):
+    return _LABELS[min(max(r, 0), 100) // 10]
+
+
+_DISCORD_INVITE_PARAMS = {"with_counts": "true", "with_expiration": "true"}
+
+
+async def _discord_probe(u: str, dc_code: str, signals: list) -> dict:
+    api = f"https://discord.com/api/v9/invites/{dc_code}"
+    r = await get_client().get(api, params=_DISCORD_INVITE_PARAMS, follow_redirects=True)
+    if r.status_code == 404:
         return {
             "ok": True,
-            "platform": "Telegram",
-            "type": "invite",
+            "platform": "Discord",
             "url": u,
-            "risk": risk,
-            "label": L,
-            "color": C,
-            "summary": "Group/Channel (invite)",
-            "signals": signals + ["Invite link pattern (+/joinchat)"],
-            "tips": ["Open in Telegram app and verify admins"],
+            "risk": 85,
+            "label": "Risk",
+            "color": "red",
+            "summary": "Discord invite is invalid or expired.",
+            "signals": signals + ["Discord API: invite not found (404)"],
+            "tips": ["Ask admins for a fresh invite", "Check official site/socials for links"],
         }
+    if r.status_code != 200:
+        return {
+            "ok": True,
+            "platform": "Discord",
+            "url": u,
+            "risk": 55,
+            "label": "Caution",
+            "color": "yellow",
+            "summary": f"Discord API returned {r.status_code}",
+            "signals": signals,
+            "tips": ["Try again later"],
+            "transient": True,
+        }
+    data = _loads(r)
+    approx = int(data.get("approximate_member_count") or 0)
+    online = int(data.get("approximate_presence_count") or 0)
+    risk = 50 if approx >= 100 else (75 if approx < 10 else 55)
+    L, C, S = _label_pack(risk)
+    return {
+        "ok": True,
+        "platform": "Discord",
+        "url": u,
+        "risk": risk,
+        "label": L,
+        "color": C,
+        "summary": S,
+        "signals": signals + [f"Members ~ {approx}, Online ~ {online}"],
+        "tips": ["Check pinned rules and roles", "Do not DM unknown users"],
+    }
 
-    username = m_tg_user.group(1)
+
+async def _telegram_user_probe(u: str, username: str, signals: list) -> dict:
     try:
-        async with httpx.AsyncClient(timeout=10, headers=UA, follow_redirects=True) as client:
-            r = await client.get(f"https://t.me/{username}")
-            text = (r.text or "").lower()
+        r = await get_client().get(f"https://t.me/{username}", follow_redirects=True, timeout=10)
     except Exception:
         risk = 45
         L, C, S = _label_pack(risk)
@@ -338,10 +403,11 @@ async def group_quick_check(url: str) -> dict:
             "summary": "Personal account",
             "signals": signals + ["Network error — mannequin fallback"],
             "tips": ["Open in Telegram app to verify profile"],
+            "transient": True,
         }
 
-    nf = (r.status_code in (404, 410)) or ("was not found" in text) or ("page not found" in text) or ("not found" in text)
-    if nf:
+    # status first: 404/410 never touch the body
+    if r.status_code in (404, 410) or _TG_NOT_FOUND_RE.search(r.content):
         risk = 85
         L, C, S = _label_pack(risk)
         return {
@@ -357,8 +423,7 @@ async def group_quick_check(url: str) -> dict:
             "tips": ["Check spelling or share a correct link"],
         }
 
-    is_chat = any(s in text for s in ("tgme_channel_history", "tgme_channel_info", "join channel", "join group"))
-    if is_chat:
+    if _TG_CHAT_RE.search(r.content):
         risk = 50
         L, C, S = _label_pack(risk)
         return {
@@ -388,3 +453,65 @@ async def group_quick_check(url: str) -> dict:
         "signals": signals + ["Username page reachable — treated as personal account"],
         "tips": ["Open in Telegram app to verify profile"],
     }
+
+
+async def _within_budget(probe, u: str, platform: str, signals: list) -> dict:
+    try:
+        return await asyncio.wait_for(probe, timeout=GROUP_CHECK_BUDGET)
+    except asyncio.TimeoutError:
+        risk = 55
+        L, C, S = _label_pack(risk)
+        return {
+            "ok": True,
+            "platform": platform,
+            "url": u,
+            "risk": risk,
+            "label": L,
+            "color": C,
+            "summary": f"{platform} did not answer in time",
+            "signals": signals + ["Upstream slow — mannequin fallback"],
+            "tips": ["Try again later"],
+            "transient": True,
+        }
+
+
+async def group_quick_check(url: str) -> dict:
+    u = (url or "").strip()
+    if not u:
+        return {"ok": False, "error": "Empty link."}
+
+    # Platforms are mutually exclusive (discord.gg / t.me): at most one network probe
+    m_dc = DC_INV_RE.search(u)
+    if m_dc:
+        signals = ["Detected platform: Discord"]
+        if m_dc.group(1) in _SCAM_INVITES:
+            return _known_scam(u, "Discord", signals)
+        return await _within_budget(_discord_probe(u, m_dc.group(1), signals), u, "Discord", signals)
+
+    m_tg_join = TG_JOIN_RE.search(u)
+    m_tg_user = TG_USER_RE.search(u)
+
+    if not (m_tg_join or m_tg_user):
+        return {"ok": False, "error": "Provide a valid Telegram link (t.me/<username> or t.me/+invite)."}
+
+    signals = ["Detected platform: Telegram"]
+
+    if m_tg_join:
+        if m_tg_join.group(1) in _SCAM_INVITES:
+            return _known_scam(u, "Telegram", signals)
+        risk = 50
+        L, C, S = _label_pack(risk)
+        return {
+            "ok": True,
+            "platform": "Telegram",
+            "type": "invite",
+            "url": u,
+            "risk": risk,
+            "label": L,
+            "color": C,
+            "summary": "Group/Channel (invite)",
+            "signals": signals + ["Invite link pattern (+/joinchat)"],
+            "tips": ["Open in Telegram app and verify admins"],
+        }
+
+    return await _within_budget(_telegram_user_probe(u, m_tg_user.group(1), signals), u, "Telegram", signals)